@@ -12,3 +12,28 @@ CREATE TABLE IF NOT EXISTS HighStressUsers (
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
   CONSTRAINT fk_user FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
+
+-- Copied from users.name by the trigger below so /alerts doesn't need a join.
+-- Added separately so re-running this script upgrades databases created before the column existed.
+ALTER TABLE HighStressUsers ADD COLUMN IF NOT EXISTS user_name TEXT;
+
+UPDATE HighStressUsers h
+SET user_name = u.name
+FROM users u
+WHERE h.user_id = u.id AND h.user_name IS NULL;
+
+CREATE OR REPLACE FUNCTION set_high_stress_user_name() RETURNS TRIGGER AS $$
+BEGIN
+  SELECT name INTO NEW.user_name FROM users WHERE id = NEW.user_id;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER high_stress_users_set_user_name
+  BEFORE INSERT ON HighStressUsers
+  FOR EACH ROW EXECUTE FUNCTION set_high_stress_user_name();
+
+-- Serves the /alerts query (newest stressed users first) as an index-only scan
+CREATE INDEX IF NOT EXISTS high_stress_users_stressed_created_at_idx
+  ON HighStressUsers (created_at DESC) INCLUDE (user_name, stress_score)
+  WHERE is_stressed;
@@ -1,18 +1,25 @@
-import json
+import logging
 
-from db_utils import get_db_connection, logger
+import orjson
+
+from db_utils import connection_lost, get_db_connection, logger
 
 # Initialize database connection at the module level
 # This allows the connection to be reused across Lambda invocations
 conn = None
 
+# Number of alerts returned when the request doesn't specify a limit, and the most it may ask for
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
 
 def handler(event, context):
     """
     Handler for the /alerts endpoint that returns an array of stressed users.
 
     This function queries the database for users who have been identified as stressed
-    and returns their information in a JSON response.
+    and returns their information in a JSON response. The number of users returned can
+    be bounded with the `limit` query string parameter.
 
     Args:
         event: The event dict that contains the request parameters
@@ -21,53 +28,75 @@ def handler(event, context):
     Returns:
         dict: A response containing the list of stressed users
     """
+    query_params = event.get("queryStringParameters") or {}
+    try:
+        limit = int(query_params.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        limit = -1
+    if not 1 <= limit <= MAX_LIMIT:
+        logger.error("Invalid limit", extra={"limit": query_params.get("limit")})
+        return {
+            "statusCode": 400,
+            "body": orjson.dumps({"error": f"limit must be an integer between 1 and {MAX_LIMIT}"}).decode(),
+        }
+
     global conn
-    if conn is None:
-      conn = get_db_connection()
+    for attempt in range(2):
+        if conn is None:
+            conn = get_db_connection()
+            # The endpoint only reads, so don't hold a transaction open between invocations
+            conn.autocommit = True
 
-    with conn.cursor() as cur:
         try:
-            # Query the HighStressUsers table for stressed users
-            # Join with users table to get the user name as record_id
-            # Format the timestamp to ISO 8601 format
-            query = """
-                SELECT u.name AS record_id,
-                       h.stress_score,
-                       TO_CHAR(h.created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS timestamp
-                FROM
-                  HighStressUsers h
-                  JOIN
-                  users u
-                ON h.user_id = u.id
-                WHERE
-                  h.is_stressed = TRUE
-                ORDER BY
-                  h.created_at DESC \
-            """
-
-            logger.debug(f"Executing query: {query}")
-            cur.execute(query)
+            with conn.cursor() as cur:
+                # Build the JSON array of the newest stressed users in Postgres, with ISO 8601 timestamps,
+                # from the partial index on HighStressUsers (user_name is copied there, so no join)
+                query = """
+                    SELECT COUNT(*),
+                           COALESCE(
+                             json_agg(
+                               json_build_object(
+                                 'record_id', user_name,
+                                 'stress_score', stress_score,
+                                 'timestamp', TO_CHAR(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"')
+                               )
+                               ORDER BY created_at DESC
+                             ),
+                             '[]'
+                           )::text
+                    FROM (
+                      SELECT user_name, stress_score, created_at
+                      FROM
+                        HighStressUsers
+                      WHERE
+                        is_stressed
+                      ORDER BY
+                        created_at DESC
+                      LIMIT %s
+                    ) AS alerts \
+                """
 
-            # Fetch all records
-            records = cur.fetchall()
-            logger.info("Found stressed user records", extra={"count": len(records)})
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Executing query: {query}")
+                cur.execute(query, (limit,))
 
-            # Format the records as an array of objects
-            result = []
-            for record in records:
-                result.append({
-                    "record_id": record[0],
-                    "stress_score": float(record[1]),
-                    "timestamp": record[2]
-                })
+                count, result = cur.fetchone()
+                logger.info("Found stressed user records", extra={"count": count})
 
             # Return the response
             return {
                 "statusCode": 200,
                 "headers": {"Content-Type": "application/json"},
-                "body": json.dumps(result),
+                "body": result,
             }
 
         except Exception as e:
+            if connection_lost(conn):
+                # RDS Proxy may drop idle connections between warm invocations, so reconnect once and retry
+                conn.close()
+                conn = None
+                if not attempt:
+                    logger.warning("Database connection lost, reconnecting", extra={"error": str(e)})
+                    continue
             logger.error("Error processing alerts", extra={"error": str(e)})
-            return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+            return {"statusCode": 500, "body": orjson.dumps({"error": str(e)}).decode()}
@@ -1,10 +1,10 @@
-import csv
-import io
-from datetime import datetime
 from enum import IntEnum
-from typing import List, Dict, Any
+from typing import Annotated, Dict, Any, Union
 
-from pydantic import BaseModel, Field, field_validator
+import msgspec
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
 
 
 class MentalHealthStatus(IntEnum):
@@ -13,102 +13,144 @@ class MentalHealthStatus(IntEnum):
   SEVERE = 2
 
 
-class MentalHealthRecord(BaseModel):
-  timestamp: datetime
-  location_id: int
-  temperature_celsius: float
-  humidity_percent: float
-  air_quality_index: int
-  noise_level_db: float
-  lighting_lux: float
-  crowd_density: int
-  stress_level: int
-  sleep_hours: float
-  mood_score: float
-  mental_health_status: MentalHealthStatus
-
-  @field_validator('stress_level')
-  def validate_stress_level(cls, v):
-    if not 0 <= v <= 100:
-      raise ValueError(f'stress_level must be between 0 and 100, got {v}')
-    return v
-
-  @field_validator('humidity_percent')
-  def validate_humidity(cls, v):
-    if not 0 <= v <= 100:
-      raise ValueError(f'humidity_percent must be between 0 and 100, got {v}')
-    return v
-
-  @field_validator('sleep_hours')
-  def validate_sleep_hours(cls, v):
-    if not 0 <= v <= 24:
-      raise ValueError(f'sleep_hours must be between 0 and 24, got {v}')
-    return v
-
-
-class MentalHealthDataset(BaseModel):
-  records: List[MentalHealthRecord]
-
-  @field_validator('records')
-  def validate_records(cls, v):
-    if not v:
-      raise ValueError('Dataset must contain at least one record')
-    return v
-
-
-class StressAnalysisResult(BaseModel):
-  stress_score: float = Field(..., ge=0, le=100)
-  reason: str = Field(..., max_length=5000)
-
-  @field_validator('stress_score')
-  def validate_stress_score(cls, v):
-    """Validate that stress_score is within range (0-100)."""
-    if not 0 <= v <= 100:
-      raise ValueError(f'stress_score must be between 0 and 100, got {v}')
-    return v
-
-
-class StressAnalysisResponse(BaseModel):
+class CsvValidationError(ValueError):
+  """Raised when the parsed CSV data violates the dataset invariants."""
+
+
+# Arrow types for every expected column. The timestamp column is left to arrow's type inference
+# so both naive and offset-qualified ISO 8601 values (including a trailing 'Z') are accepted.
+COLUMN_TYPES = {
+  'location_id': pa.int32(),
+  'temperature_celsius': pa.float64(),
+  'humidity_percent': pa.float64(),
+  'air_quality_index': pa.int32(),
+  'noise_level_db': pa.float64(),
+  'lighting_lux': pa.float64(),
+  'crowd_density': pa.int32(),
+  'stress_level': pa.int32(),
+  'sleep_hours': pa.float64(),
+  'mood_score': pa.float64(),
+  'mental_health_status': pa.int8(),
+}
+COLUMN_NAMES = ['timestamp', *COLUMN_TYPES]
+
+# Inclusive bounds checked against the parsed columns
+COLUMN_RANGES = {
+  'stress_level': (0, 100),
+  'humidity_percent': (0, 100),
+  'sleep_hours': (0, 24),
+  'mental_health_status': (min(MentalHealthStatus), max(MentalHealthStatus)),
+}
+
+# Built once so warm invocations don't pay for option construction
+_READ_OPTIONS = pv.ReadOptions(block_size=1 << 20)
+_PARSE_OPTIONS = pv.ParseOptions()
+_CONVERT_OPTIONS = pv.ConvertOptions(column_types=COLUMN_TYPES, include_columns=COLUMN_NAMES)
+
+
+class StressAnalysisResult(msgspec.Struct, gc=False):
+  stress_score: Annotated[float, msgspec.Meta(ge=0, le=100)]
+  reason: Annotated[str, msgspec.Meta(max_length=5000)]
+
+
+class StressAnalysisResponse(msgspec.Struct, gc=False):
   message: str
   user_id: str
   stress_analysis: Dict[str, Any]
 
 
-def parse_csv_to_models(csv_content: str) -> MentalHealthDataset:
-  """Parse CSV content into MentalHealthDataset model.
+def parse_csv_to_models(csv_content: Union[bytes, str]) -> pa.Table:
+  """Parse and validate CSV content into an arrow Table.
+
+  Parsing and type coercion happen in arrow's native CSV reader, and the range invariants are checked with
+  vectorized compute kernels instead of per-record validators. UTF-8 bytes are read in place without decoding.
   >>> csv = '''timestamp,location_id,temperature_celsius,humidity_percent,air_quality_index,noise_level_db,lighting_lux,crowd_density,stress_level,sleep_hours,mood_score,mental_health_status
   ... 2025-07-27T10:00:00Z,1,23.5,45.0,50,65.5,500.0,10,75,7.5,6.5,1'''
   >>> dataset = parse_csv_to_models(csv)
-  >>> len(dataset.records)
+  >>> dataset.num_rows
+  1
+  >>> parse_csv_to_models(csv.encode()).num_rows
   1
 
+  >>> parse_csv_to_models(csv.replace(',75,', ',175,'))
+  Traceback (most recent call last):
+      ...
+  csv_utils.CsvValidationError: stress_level must be between 0 and 100, got 175 in row 1
+
   >>> invalid_csv = '''timestamp,location_id
   ... 2025-07-27T10:00:00Z,1'''
   >>> parse_csv_to_models(invalid_csv)
   Traceback (most recent call last):
       ...
-  KeyError: 'temperature_celsius'
+  pyarrow.lib.ArrowKeyError: Column 'temperature_celsius' in include_columns does not exist in CSV file
+  """
+  if isinstance(csv_content, str):
+    csv_content = csv_content.encode()
+
+  table = pv.read_csv(
+    pa.py_buffer(csv_content),
+    read_options=_READ_OPTIONS,
+    parse_options=_PARSE_OPTIONS,
+    convert_options=_CONVERT_OPTIONS,
+  )
+
+  if table.num_rows == 0:
+    raise CsvValidationError('Dataset must contain at least one record')
+
+  # include_columns fixes the column order, so walk the columns positionally rather than by name
+  for name, column in zip(COLUMN_NAMES, table.columns):
+    if column.null_count:
+      raise CsvValidationError(f'{name} must not be empty')
+
+  timestamps = table.column('timestamp')
+  if not pa.types.is_timestamp(timestamps.type):
+    raise CsvValidationError('timestamp must be an ISO 8601 datetime')
+  if timestamps.type.tz is None:
+    table = table.set_column(0, 'timestamp', pc.assume_timezone(timestamps, 'UTC'))
+
+  for name, (low, high) in COLUMN_RANGES.items():
+    # A single min/max pass per column; the offending row is only located once we know there is one
+    column = table.column(name)
+    bounds = pc.min_max(column)
+    if bounds['min'].as_py() < low or bounds['max'].as_py() > high:
+      row = pc.index(pc.or_(pc.less(column, low), pc.greater(column, high)), True).as_py()
+      raise CsvValidationError(f'{name} must be between {low} and {high}, got {column[row].as_py()} in row {row + 1}')
+
+  return table
+
+
+def summarize_dataset(table: pa.Table, sample_size: int = 5) -> Dict[str, Any]:
+  """Compute the aggregate indicators handed to the LLM instead of the raw CSV.
+
+  Each indicator column is converted to a NumPy array once, so the statistics run as vectorized loops.
+  The threshold counts mirror the analysis guidelines given to the LLM.
+  >>> csv = '''timestamp,location_id,temperature_celsius,humidity_percent,air_quality_index,noise_level_db,lighting_lux,crowd_density,stress_level,sleep_hours,mood_score,mental_health_status
+  ... 2025-07-27T10:00:00Z,1,23.5,45.0,50,65.5,500.0,10,75,7.5,6.5,1
+  ... 2025-07-27T11:00:00Z,1,23.5,45.0,50,65.5,500.0,10,25,5.5,1.5,2'''
+  >>> summary = summarize_dataset(parse_csv_to_models(csv))
+  >>> summary['mean_stress_level'], summary['max_stress_level'], summary['min_sleep_hours']
+  (50.0, 75, 5.5)
+  >>> summary['elevated_stress_count'], summary['low_sleep_count'], summary['poor_mood_count']
+  (1, 1, 1)
+  >>> summary['severe_status_count'], len(summary['sample_records'])
+  (1, 2)
   """
-  csv_file = io.StringIO(csv_content)
-  csv_reader = csv.DictReader(csv_file)
-
-  records = []
-  for row in csv_reader:
-    # Convert string values to appropriate types
-    record = MentalHealthRecord(
-      timestamp=datetime.fromisoformat(row['timestamp'].replace('Z', '+00:00')),
-      location_id=int(row['location_id']),
-      temperature_celsius=float(row['temperature_celsius']),
-      humidity_percent=float(row['humidity_percent']),
-      air_quality_index=int(row['air_quality_index']),
-      noise_level_db=float(row['noise_level_db']),
-      lighting_lux=float(row['lighting_lux']),
-      crowd_density=int(row['crowd_density']),
-      stress_level=int(row['stress_level']),
-      sleep_hours=float(row['sleep_hours']),
-      mood_score=float(row['mood_score']),
-      mental_health_status=int(row['mental_health_status'])
-    )
-    records.append(record)
-
-  return MentalHealthDataset(records=records)
+  stress_level = table.column('stress_level').to_numpy()
+  sleep_hours = table.column('sleep_hours').to_numpy()
+  mood_score = table.column('mood_score').to_numpy()
+  mental_health_status = table.column('mental_health_status').to_numpy()
+
+  return {
+    'record_count': table.num_rows,
+    'mean_stress_level': float(stress_level.mean()),
+    'max_stress_level': int(stress_level.max()),
+    'elevated_stress_count': int((stress_level > 40).sum()),
+    'mean_sleep_hours': float(sleep_hours.mean()),
+    'min_sleep_hours': float(sleep_hours.min()),
+    'low_sleep_count': int((sleep_hours < 6).sum()),
+    'mean_mood_score': float(mood_score.mean()),
+    'min_mood_score': float(mood_score.min()),
+    'poor_mood_count': int((mood_score < 2.0).sum()),
+    'severe_status_count': int((mental_health_status == MentalHealthStatus.SEVERE).sum()),
+    'sample_records': table.slice(0, sample_size).to_pylist(),
+  }
@@ -1,29 +1,93 @@
 import logging
 import os
+import time
 
-import psycopg2
+import psycopg
 
 # Configure logging
 log_level = os.environ.get('LOG_LEVEL', 'DEBUG').upper()
 logger = logging.getLogger()
 logger.setLevel(log_level)
 
+CONNECT_ATTEMPTS = 3
+CONNECT_BACKOFF_SECONDS = 0.1
+
+# RDS IAM auth tokens are valid for 15 minutes, so refresh them a minute early
+IAM_TOKEN_TTL_SECONDS = 14 * 60
+_rds_client = None
+_iam_token = None
+_iam_token_expires_at = 0.0
+
+
+def _get_iam_auth_token(host, port, user):
+    """
+    Return a cached RDS IAM auth token, generating a new one once it is close to expiring.
+    """
+    global _rds_client, _iam_token, _iam_token_expires_at
+    now = time.monotonic()
+    if _iam_token is None or now >= _iam_token_expires_at:
+        if _rds_client is None:
+            # boto3 ships with the Lambda runtime, and is only needed when IAM auth is enabled
+            import boto3
+            _rds_client = boto3.client("rds")
+        _iam_token = _rds_client.generate_db_auth_token(DBHostname=host, Port=int(port), DBUsername=user)
+        _iam_token_expires_at = now + IAM_TOKEN_TTL_SECONDS
+        logger.debug("Generated new RDS IAM auth token")
+    return _iam_token
+
+
+def connection_lost(conn):
+    """
+    Return whether conn can no longer be used, e.g. because RDS Proxy closed an idle socket.
+
+    Server errors on a healthy connection (QueryCanceled, DeadlockDetected, ...) are also
+    OperationalErrors, so callers check this rather than the exception type before reconnecting.
+    """
+    return conn.closed or conn.broken
+
+
 def get_db_connection():
     """
     Create and return a database connection.
 
     This function creates a new connection to the PostgreSQL database
-    using environment variables for configuration.
+    using environment variables for configuration. When PGPREPARE is "true",
+    statements are prepared server-side on first use so warm invocations skip
+    re-parsing the SQL.
+
+    PGHOST may point at an RDS Proxy endpoint. When PGIAMAUTH is "true", an
+    IAM auth token is used in place of PGPASSWORD and SSL is required.
+    PGPREPARE then defaults to "false": named prepared statements pin the
+    session at RDS Proxy and break under pgbouncer transaction pooling.
+    Transient connection failures are retried with exponential backoff.
 
     Returns:
-        psycopg2.connection: A connection to the PostgreSQL database
+        psycopg.Connection: A connection to the PostgreSQL database
     """
-    conn = psycopg2.connect(
-        host=os.environ.get("PGHOST", "localhost"),
-        database=os.environ.get("PGDATABASE", "users"),
-        user=os.environ.get("PGUSER", "postgres"),
-        password=os.environ.get("PGPASSWORD", "example"),
-        port=os.environ.get("PGPORT", "5432"),
-    )
+    host = os.environ.get("PGHOST", "localhost")
+    port = os.environ.get("PGPORT", "5432")
+    user = os.environ.get("PGUSER", "postgres")
+    use_iam_auth = os.environ.get("PGIAMAUTH", "false").lower() == "true"
+    use_prepared = os.environ.get("PGPREPARE", "false" if use_iam_auth else "true").lower() == "true"
+
+    for attempt in range(CONNECT_ATTEMPTS):
+        try:
+            conn = psycopg.connect(
+                host=host,
+                dbname=os.environ.get("PGDATABASE", "users"),
+                user=user,
+                password=_get_iam_auth_token(host, port, user) if use_iam_auth else os.environ.get("PGPASSWORD", "example"),
+                port=port,
+                sslmode=os.environ.get("PGSSLMODE", "require" if use_iam_auth else "prefer"),
+                prepare_threshold=0 if use_prepared else None,
+            )
+            break
+        except psycopg.OperationalError as e:
+            if attempt == CONNECT_ATTEMPTS - 1:
+                raise
+            delay = CONNECT_BACKOFF_SECONDS * 2 ** attempt
+            logger.warning("Database connection failed, retrying", extra={"error": str(e), "delay": delay})
+            time.sleep(delay)
+
     logger.debug("Database connection established successfully")
     return conn
@@ -1,36 +1,129 @@
-import json
 import logging
+from collections import OrderedDict
+from typing import Optional
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+  # SIMD-accelerated hashing for the response cache keys
+  from blake3 import blake3 as _hash
+except ImportError:
+  from hashlib import blake2b as _hash
 
 logger = logging.getLogger()
 
-def query_ollama(prompt: str, url: str, model: str) -> str:
+# Reuse one session across warm Lambda invocations so the connection to Ollama stays alive
+# instead of paying a new TCP handshake on every request. A container serves one invocation
+# at a time, so a single pooled connection is enough.
+# urllib3 already sets TCP_NODELAY on its sockets and requests never sends Expect: 100-continue.
+_ADAPTER = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+_SESSION = requests.Session()
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+
+# (connect, read) timeouts in seconds; generation can take a while on CPU-only hosts
+OLLAMA_TIMEOUT = (2, 120)
+
+# Keep the model (and its cached prompt prefix) loaded between requests
+OLLAMA_KEEP_ALIVE = "10m"
+
+# Validated Ollama responses are kept in-process so repeated uploads of the same data (retries, tests)
+# skip the LLM entirely. Bounded by the total size of the raw responses in bytes.
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class ResponseCache:
+  """LRU cache of validated responses keyed by response_cache_key, bounded by total size in bytes.
+  >>> cache = ResponseCache(max_bytes=10)
+  >>> cache.put(b'a', 'first', 4)
+  >>> cache.put(b'b', 'second', 4)
+  >>> cache.get(b'a')
+  'first'
+  >>> cache.put(b'c', 'third', 4)
+  >>> cache.get(b'b') is None, cache.get(b'a'), cache.get(b'c')
+  (True, 'first', 'third')
+  >>> cache.put(b'd', 'too big', 11)
+  >>> cache.get(b'd') is None, len(cache), cache.size
+  (True, 2, 8)
+  """
+
+  def __init__(self, max_bytes: int):
+    self.max_bytes = max_bytes
+    self.size = 0
+    self._entries = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def get(self, key: bytes):
+    entry = self._entries.get(key)
+    if entry is None:
+      return None
+    self._entries.move_to_end(key)
+    return entry[0]
+
+  def put(self, key: bytes, value, size: int) -> None:
+    if key in self._entries or size > self.max_bytes:
+      return
+    self._entries[key] = (value, size)
+    self.size += size
+    while self.size > self.max_bytes:
+      _, (_, evicted_size) = self._entries.popitem(last=False)
+      self.size -= evicted_size
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+
+
+def response_cache_key(prompt: str, model: str, system: Optional[str] = None) -> bytes:
+  hasher = _hash(model.encode())
+  hasher.update(b"\0")
+  if system:
+    hasher.update(system.encode())
+  hasher.update(b"\0")
+  hasher.update(prompt.encode())
+  return hasher.digest()
+
+
+def query_ollama(prompt: str, url: str, model: str, system: Optional[str] = None) -> str:
   """
   Query the Ollama API with a prompt and return the generated response.
+
+  A constant system prompt lets Ollama reuse its cached evaluation of it across requests.
   """
   payload = {
     "model": model,
     "prompt": prompt,
     "stream": False,
-    "format": "json"
+    "format": "json",
+    "keep_alive": OLLAMA_KEEP_ALIVE,
   }
+  if system:
+    payload["system"] = system
 
-  logger.debug("Ollama request details", extra={
-    "url": url,
-    "model": model,
-    "prompt_preview": prompt[:500] + ("..." if len(prompt) > 500 else ""),
-    "prompt_length": len(prompt)
-  })
+  if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("Ollama request details", extra={
+      "url": url,
+      "model": model,
+      "prompt_preview": prompt[:500] + ("..." if len(prompt) > 500 else ""),
+      "prompt_length": len(prompt)
+    })
 
   logger.debug("Sending request to Ollama API", extra={"url": url, "model": model})
-  response = requests.post(url, json=payload)
+  response = _SESSION.post(
+    url,
+    data=orjson.dumps(payload),
+    headers={"Content-Type": "application/json"},
+    timeout=OLLAMA_TIMEOUT,
+  )
   logger.debug("Ollama API response received", extra={"status_code": response.status_code})
 
   response.raise_for_status()
-  result = response.json()
+  result = orjson.loads(response.content)
 
-  logger.debug("Ollama raw response", extra={"response": json.dumps(result)[:1000] + "..."})
+  if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("Ollama raw response", extra={"response": response.content[:1000].decode(errors="replace") + "..."})
 
   return result.get("response", "")
-
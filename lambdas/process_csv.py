@@ -1,23 +1,65 @@
-import base64
-import json
 import logging
 import os
 
-from pydantic import ValidationError
+import msgspec
+import orjson
+
+try:
+    # SIMD-accelerated base64 with the same b64decode signature as the stdlib module
+    import pybase64 as base64
+except ImportError:
+    import base64
 
 from csv_utils import (
+  CsvValidationError,
   parse_csv_to_models,
   StressAnalysisResult,
+  summarize_dataset,
 )
-from db_utils import get_db_connection, logger
+from db_utils import connection_lost, get_db_connection, logger
 from llm_utils import (
-  query_ollama
+  query_ollama,
+  response_cache,
+  response_cache_key,
 )
 
 # Get environment variables for Ollama
 OLLAMA_GENERATE_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434/api/generate")
 OLLAMA_MODEL_NAME = os.environ.get("OLLAMA_MODEL", "llama3")
 
+# Built once so each invocation reuses the compiled decoder for the LLM's response. Lax mode
+# keeps the old Pydantic coercion, e.g. accepting a quoted "55" as stress_score
+_ANALYSIS_DECODER = msgspec.json.Decoder(StressAnalysisResult, strict=False)
+
+# Instructions sent to Ollama as the system prompt. They never change between invocations, and
+# because they come first in the model's context Ollama can reuse its cached work for them
+# instead of re-evaluating them on every request; only the summary in the prompt differs.
+_SYSTEM_PROMPT = '''\
+You are a mental health expert analyzing student stress levels.
+
+CRITICAL: You must respond with ONLY valid JSON in the exact format specified below. Do not include any other text, explanations, or formatting.
+
+You will be given a summary of a student's data containing aggregate statistics over all records and a small sample of the raw records.
+
+Analysis Guidelines:
+- Focus on stress_level, sleep_hours, mood_score, and mental_health_status indicators
+- mental_health_status is 0 (normal), 1 (concern) or 2 (severe)
+- stress_level > 40 indicates elevated stress
+- sleep_hours < 6 indicates insufficient sleep
+- mood_score < 2.0 indicates poor mood
+- mental_health_status concerns indicate mental health issues
+
+IMPORTANT: Write concisely. Avoid phrases like "After analyzing", "it is evident", "based on the data", "the analysis reveals". State facts directly.
+
+Return ONLY this JSON structure:
+{
+    "stress_score": <number between 0 and 100, where 0 is no stress and 100 is extreme stress>,
+    "reason": "<Your assessment in 500 words or less, analyzing the key indicators: stress levels, sleep patterns, mood scores, and mental health status. Include specific data points and explain why they indicate stress or lack thereof.>"
+}
+'''
+_PROMPT_PREFIX = "Task: Analyze the following summary of the student's data to determine if there are signs of stress:\n"
+_PROMPT_SUFFIX = "\n"
+
 # Allow the connection to be reused across Lambda invocations
 conn = None
 
@@ -26,17 +68,30 @@ logger = logging.getLogger()
 logger.setLevel(log_level)
 
 
+def _rollback_transaction():
+    """
+    Roll back the open transaction so a failed request doesn't leave its users row pending,
+    which would make a retry of the same name look like a duplicate.
+    """
+    global conn
+    if connection_lost(conn):
+        conn.close()
+        conn = None
+    else:
+        conn.rollback()
+
+
 def handler(event, _) -> dict:
     """
     Handler for processing CSV files uploaded to the /datasets/{id} endpoint.
 
     This function:
-    1. Parses and validates the CSV data using Pydantic models
+    1. Parses and validates the CSV data into an arrow Table
     2. Performs preliminary analysis on the mental health indicators
     3. Passes the analyzed data to Ollama for stress assessment
     4. Stores the results in the database if stress is detected
 
-    The CSV data is expected to follow the structure defined in the MentalHealthRecord model.
+    The CSV data is expected to follow the columns defined in csv_utils.COLUMN_TYPES.
     """
     global conn
     if conn is None:
@@ -51,126 +106,127 @@ def handler(event, _) -> dict:
             logger.error("Error: Missing dataset name in path")
             return {
                 "statusCode": 400,
-                "body": json.dumps({"error": "Missing name in path"}),
+                "body": orjson.dumps({"error": "Missing name in path"}).decode(),
             }
 
-        # Insert the user record at the very beginning to avoid wasting time
-        # on expensive operations if the user already exists
-        logger.debug("Connecting to PostgreSQL database")
-        with conn.cursor() as cur:
-            logger.debug("Inserting record into users table")
-            try:
-                cur.execute(
-                    "INSERT INTO users (id, name) VALUES (gen_random_uuid(), %s) RETURNING id",
-                    (dataset_name,)
-                )
-
-                # Fetch the UUID from the database to ensure it was inserted correctly
-                inserted_uuid = cur.fetchone()[0]
-                logger.info("Successfully inserted user with UUID", extra={"uuid": inserted_uuid})
-
-                # Note: We don't commit here so both insertions will be in the same transaction
-            except Exception as e:
-                # If a unique constraint violation occurs, rollback the transaction
-                if conn:
-                    conn.rollback()
-                if "unique constraint" in str(e).lower():
-                    logger.warning("Unique constraint violation", extra={"error": str(e)})
-                    return {
-                        "statusCode": 409,
-                        "body": json.dumps(
-                            {"error": f"A student with the ID '{dataset_name}' already exists. Please use a different student ID."})
-                    }
-                else:
-                    # If any other error occurs, rollback the transaction
-                    logger.error("Error during database operations", extra={"error": str(e)})
-                    raise
-
         # Get the CSV file from the request body
         body = event.get("body", "")
-        logger.debug(f"Request body size: {len(body)} characters")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Request body size: {len(body)} characters")
 
         if not body:
             logger.error("Error: Missing CSV file in request body")
             return {
                 "statusCode": 400,
-                "body": json.dumps({"error": "Missing CSV file in request body"}),
+                "body": orjson.dumps({"error": "Missing CSV file in request body"}).decode(),
             }
 
         is_base64 = event.get("isBase64Encoded", False)
         if is_base64:
+            # Keep the decoded bytes as-is; the CSV parser reads UTF-8 bytes directly,
+            # which avoids materializing a second full copy of the upload as a str
             logger.debug("Decoding base64 encoded body")
-            body = base64.b64decode(body).decode('utf-8')
+            body = base64.b64decode(body, validate=False)
 
         try:
-            logger.debug("Parsing CSV data into Pydantic models")
+            logger.debug("Parsing CSV data into an arrow Table")
             mental_health_dataset = parse_csv_to_models(body)
 
-            # Log basic information about the dataset
-            record_count = len(mental_health_dataset.records)
-            logger.debug(f"Successfully parsed {record_count} records from CSV")
+            if logger.isEnabledFor(logging.DEBUG):
+                # Log basic information about the dataset
+                logger.debug(f"Successfully parsed {mental_health_dataset.num_rows} records from CSV")
 
-            # Log a sample of the parsed data (first 2 records)
-            if record_count > 0:
+                # Log a sample of the parsed data (first 2 records)
                 logger.debug("Sample of parsed records:")
-                for i, record in enumerate(mental_health_dataset.records[:2]):
-                    logger.debug(f"Record {i + 1}: {record.dict()}")
+                for i, record in enumerate(mental_health_dataset.slice(0, 2).to_pylist()):
+                    logger.debug(f"Record {i + 1}: {record}")
 
-        except ValidationError as e:
+        except CsvValidationError as e:
             logger.error(f"Validation error in CSV data: {str(e)}")
             return {
                 "statusCode": 400,
-                "body": json.dumps({"error": f"Invalid CSV data format: {str(e)}"}),
+                "body": orjson.dumps({"error": f"Invalid CSV data format: {str(e)}"}).decode(),
             }
         except Exception as e:
             logger.warning(f"Could not parse CSV structure: {str(e)}")
             return {
                 "statusCode": 400,
-                "body": json.dumps({"error": f"Could not parse CSV data: {str(e)}"}),
+                "body": orjson.dumps({"error": f"Could not parse CSV data: {str(e)}"}).decode(),
             }
 
         # Create a prompt for Ollama to analyze stress levels
         logger.debug("Creating prompt for Ollama")
 
-        # Include our pre-analyzed stress indicators in the prompt
-        prompt = f'''
-                You are a mental health expert analyzing student stress levels.
+        # Include our pre-analyzed stress indicators in the prompt rather than the raw CSV,
+        # so the prompt size (and the LLM's tokenization work) no longer grows with the dataset
+        summary = orjson.dumps(summarize_dataset(mental_health_dataset)).decode()
+        prompt = _PROMPT_PREFIX + summary + _PROMPT_SUFFIX
 
-                CRITICAL: You must respond with ONLY valid JSON in the exact format specified below. Do not include any other text, explanations, or formatting.
-
-                Task: Analyze the following data to determine if there are signs of stress:
-                {body}
-
-                Analysis Guidelines:
-                - Focus on stress_level, sleep_hours, mood_score, and mental_health_status indicators
-                - stress_level > 40 indicates elevated stress
-                - sleep_hours < 6 indicates insufficient sleep
-                - mood_score < 2.0 indicates poor mood
-                - mental_health_status concerns indicate mental health issues
-
-                IMPORTANT: Write concisely. Avoid phrases like "After analyzing", "it is evident", "based on the data", "the analysis reveals". State facts directly.
+        # Insert the user record before calling Ollama to avoid wasting time
+        # on expensive operations if the user already exists
+        logger.debug("Connecting to PostgreSQL database")
+        for attempt in range(2):
+            try:
+                with conn.cursor() as cur:
+                    logger.debug("Inserting record into users table")
+                    # ON CONFLICT turns a duplicate name into an empty result instead of an error,
+                    # so the 409 case needs no exception handling
+                    cur.execute(
+                        "INSERT INTO users (id, name) VALUES (gen_random_uuid(), %s) ON CONFLICT (name) DO NOTHING RETURNING id",
+                        (dataset_name,)
+                    )
+                    inserted_row = cur.fetchone()
+                break
+            except Exception as e:
+                if connection_lost(conn):
+                    # RDS Proxy may drop idle connections between warm invocations. Nothing has
+                    # been written yet, so reconnect once and retry the insert
+                    conn.close()
+                    conn = None
+                    if attempt:
+                        raise
+                    logger.warning("Database connection lost, reconnecting", extra={"error": str(e)})
+                    conn = get_db_connection()
+                    continue
+                # If any other error occurs, rollback the transaction
+                conn.rollback()
+                logger.error("Error during database operations", extra={"error": str(e)})
+                raise
+
+        if inserted_row is None:
+            logger.warning("User already exists", extra={"dataset_name": dataset_name})
+            # Nothing was written, but end the transaction so the connection isn't left idle in it
+            conn.rollback()
+            return {
+                "statusCode": 409,
+                "body": orjson.dumps(
+                    {"error": f"A student with the ID '{dataset_name}' already exists. Please use a different student ID."}).decode()
+            }
 
-                Return ONLY this JSON structure:
-                {{
-                    "stress_score": <number between 0 and 100, where 0 is no stress and 100 is extreme stress>,
-                    "reason": "<Your assessment in 500 words or less, analyzing the key indicators: stress levels, sleep patterns, mood scores, and mental health status. Include specific data points and explain why they indicate stress or lack thereof.>"
-                }}
-            '''
+        # Fetch the UUID from the database to ensure it was inserted correctly
+        inserted_uuid = inserted_row[0]
+        logger.info("Successfully inserted user with UUID", extra={"uuid": inserted_uuid})
 
-        logger.info("Calling Ollama API for stress analysis")
-        stress_analysis = query_ollama(prompt, url=OLLAMA_GENERATE_URL, model=OLLAMA_MODEL_NAME)
+        # Note: We don't commit here so both insertions will be in the same transaction
 
         try:
-            # Parse the JSON response from Ollama and validate with Pydantic
-            logger.debug("Parsing and validating Ollama response")
-            analysis_data_raw = json.loads(stress_analysis)
-
-            # Validate the response using our Pydantic model
-            # This ensures the response contains the required fields (stress_score and reason)
-            # and that they meet our validation rules (e.g., stress_score between 0-100)
-            # If validation fails, a ValidationError will be raised and caught below
-            logger.debug("Validating response structure with StressAnalysisResult model")
-            analysis_data = StressAnalysisResult(**analysis_data_raw)
+            cache_key = response_cache_key(prompt, OLLAMA_MODEL_NAME, _SYSTEM_PROMPT)
+            analysis_data = response_cache.get(cache_key)
+            if analysis_data is None:
+                logger.info("Calling Ollama API for stress analysis")
+                stress_analysis = query_ollama(prompt, url=OLLAMA_GENERATE_URL, model=OLLAMA_MODEL_NAME, system=_SYSTEM_PROMPT)
+
+                # Decode the JSON response from Ollama straight into our msgspec model
+                # This ensures the response contains the required fields (stress_score and reason)
+                # and that they meet our validation rules (e.g., stress_score between 0-100)
+                # If validation fails, a ValidationError will be raised and caught below
+                logger.debug("Decoding and validating Ollama response with StressAnalysisResult model")
+                analysis_data = _ANALYSIS_DECODER.decode(stress_analysis)
+
+                # Only validated results are cached, so a retry after a bad reply asks Ollama again
+                response_cache.put(cache_key, analysis_data, len(stress_analysis.encode()))
+            else:
+                logger.info("Using cached Ollama response for an identical prompt")
 
             # Extract the fields from the validated response
             # Since the response has been validated, we can safely access these fields
@@ -184,7 +240,8 @@ def handler(event, _) -> dict:
             logger.info("Extracted data from Ollama response",
                         extra={"stress_score": stress_score, "threshold": stress_threshold, "is_stressed": is_stressed})
 
-            with conn.cursor() as cur:
+            # Pipeline mode sends the insert and the commit in a single round-trip
+            with conn.pipeline(), conn.cursor() as cur:
                 if is_stressed:
                     logger.info("Stress score exceeds threshold, inserting into HighStressUsers table",
                                 extra={"stress_score": stress_score, "threshold": stress_threshold})
@@ -206,36 +263,39 @@ def handler(event, _) -> dict:
             return {
                 "statusCode": 200,
                 "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({
+                "body": orjson.dumps({
                     "user_id": str(inserted_uuid),
                     "stress_analysis": {
                         "stress_score": stress_score,
                         "analysis": reason,
                         "threshold_exceeded": is_stressed
                     },
-                }),
+                }).decode(),
             }
-        except ValidationError as e:
+        except msgspec.ValidationError as e:
             logger.error("Validation error in Ollama response", extra={"error": str(e)})
+            _rollback_transaction()
             return {
                 "statusCode": 500,
-                "body": json.dumps({"error": f"Invalid response format from LLM: {str(e)}. SREs have been notified."}),
+                "body": orjson.dumps({"error": f"Invalid response format from LLM: {str(e)}. SREs have been notified."}).decode(),
             }
-        except json.JSONDecodeError as e:
+        except msgspec.DecodeError as e:
             logger.error("Error parsing Ollama response", extra={"error": str(e)})
+            _rollback_transaction()
             logger.error("Raw Ollama response",
                         extra={"response": stress_analysis[:1000] + ("..." if len(stress_analysis) > 1000 else "")})
             return {
                 "statusCode": 500,
-                "body": json.dumps({"error": f"Invalid JSON response from LLM. SREs have been notified."}),
+                "body": orjson.dumps({"error": f"Invalid JSON response from LLM. SREs have been notified."}).decode(),
             }
         except Exception as e:
             logger.error("Error processing Ollama response", extra={"error": str(e)})
+            _rollback_transaction()
             return {
                 "statusCode": 500,
-                "body": json.dumps({"error": f"Error processing response: {str(e)}"}),
+                "body": orjson.dumps({"error": f"Error processing response: {str(e)}"}).decode(),
             }
 
     except Exception as e:
         logger.error(f"Error processing CSV error={str(e)})")
-        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+        return {"statusCode": 500, "body": orjson.dumps({"error": str(e)}).decode()}